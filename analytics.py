@@ -0,0 +1,110 @@
+from datetime import date
+from sqlalchemy import Date, String, cast, func, literal, select, text
+from sqlalchemy.dialects.postgresql import insert
+from models import db, Artist, Venue, Show, ShowRollup, RollupWatermark
+
+WATERMARK = 'shows'
+
+def _month(column):
+  return cast(func.date_trunc('month', column), Date)
+
+def _rollup_selects(low, high):
+  """One SELECT per dimension, counting the shows with low < id <= high."""
+  genre = func.unnest(Artist.genres).column_valued('genre')
+  month = _month(Show.start_time)
+  shows = select().select_from(Show).join(Venue, Show.venue).join(Artist, Show.artist)
+  if low is not None:
+    shows = shows.where(Show.id > low, Show.id <= high)
+
+  keys = (
+    ('venue', cast(Show.venue_id, String)),
+    ('artist', cast(Show.artist_id, String)),
+    ('genre', genre),
+    ('state', Venue.state),
+  )
+  for dimension, key in keys:
+    yield shows \
+      .add_columns(literal(dimension).label('dimension'), key.label('key'), month.label('month'), func.count().label('show_count')) \
+      .group_by(key, month)
+
+def _upsert(query):
+  statement = insert(ShowRollup).from_select(['dimension', 'key', 'month', 'show_count'], query)
+  return statement.on_conflict_do_update(
+    index_elements=['dimension', 'key', 'month'],
+    set_={'show_count': ShowRollup.show_count + statement.excluded.show_count}
+  )
+
+def refresh():
+  """Adds the shows created since the last refresh to the rollups.
+
+  Returns the number of shows added. Deleted shows and later edits of a
+  venue's state or an artist's genres are not reflected, rebuild() recounts
+  everything for that.
+  """
+  high = db.session.query(func.max(Show.id)).scalar() or 0
+  watermark = db.session.get(RollupWatermark, WATERMARK)
+  if watermark is not None and watermark.last_show_id >= high:
+    db.session.rollback()
+    return 0
+
+  db.session.execute(
+    insert(RollupWatermark).values(name=WATERMARK, last_show_id=0).on_conflict_do_nothing()
+  )
+  # The row lock serializes concurrent refreshes
+  watermark = db.session.query(RollupWatermark).filter_by(name=WATERMARK).with_for_update().populate_existing().one()
+  # Show ids are handed out before the inserting transactions commit, so a
+  # show with a lower id can become visible after one with a higher id.
+  # SHARE mode waits for those transactions and holds new inserts back until
+  # this refresh commits, so no show is skipped.
+  db.session.execute(text('LOCK TABLE "Show" IN SHARE MODE'))
+  low = watermark.last_show_id
+  high = db.session.query(func.max(Show.id)).scalar() or 0
+  added = 0
+  if high > low:
+    added = db.session.query(func.count(Show.id)).filter(Show.id > low, Show.id <= high).scalar()
+    for query in _rollup_selects(low, high):
+      db.session.execute(_upsert(query))
+    watermark.last_show_id = high
+  db.session.commit()
+  return added
+
+def rebuild():
+  """Recounts the rollups from every show."""
+  db.session.execute(text('LOCK TABLE "Show" IN SHARE MODE'))
+  db.session.query(ShowRollup).delete()
+  high = db.session.query(func.max(Show.id)).scalar() or 0
+  for query in _rollup_selects(None, None):
+    db.session.execute(_upsert(query))
+  db.session.execute(
+    insert(RollupWatermark)
+      .values(name=WATERMARK, last_show_id=high)
+      .on_conflict_do_update(index_elements=['name'], set_={'last_show_id': high})
+  )
+  db.session.commit()
+
+def quarter_start(day):
+  return date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+
+def add_months(day, months):
+  month = day.month - 1 + months
+  return date(day.year + month // 12, month % 12 + 1, 1)
+
+def top(dimension, start, end, limit=10):
+  """The keys with the most shows in [start, end), as (key, count) rows."""
+  total = func.sum(ShowRollup.show_count).label('total')
+  return db.session.query(ShowRollup.key, total) \
+    .filter(ShowRollup.dimension == dimension, ShowRollup.month >= start, ShowRollup.month < end) \
+    .group_by(ShowRollup.key) \
+    .order_by(total.desc(), ShowRollup.key) \
+    .limit(limit) \
+    .all()
+
+def monthly(dimension, start, end):
+  """{key: {month: count}} for every key with shows in [start, end)."""
+  rows = db.session.query(ShowRollup.key, ShowRollup.month, ShowRollup.show_count) \
+    .filter(ShowRollup.dimension == dimension, ShowRollup.month >= start, ShowRollup.month < end) \
+    .all()
+  data = {}
+  for key, month, count in rows:
+    data.setdefault(key, {})[month] = count
+  return data
@@ -4,16 +4,26 @@
 
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, flash, redirect, url_for
+from flask import Flask, Response, render_template, stream_template, request, flash, get_flashed_messages, redirect, url_for, jsonify, abort
 from flask_moment import Moment
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import CSRFProtect
-from forms import ShowForm, VenueForm, ArtistForm, SearchForm
+from forms import ShowForm, TourForm, VenueForm, ArtistForm, SearchForm
 from flask_migrate import Migrate
-from collections import defaultdict
-from datetime import datetime
-from models import db, Venue, Artist, Show
+from itertools import groupby
+from datetime import date, datetime
+from models import db, Location, Venue, Artist, Show
+import metrics
+from enums import State
+from search_cache import SearchCache, normalize_term
+from matching import MatchEngine
+from profiling import Profiler
+from booking import book_tour, parse_tour_date, parse_tour_lines
+import analytics
+from streaming import CompressionMiddleware, buffered
+from group_commit import GroupCommitWriter
+from summary_cache import SummaryCache
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -24,7 +34,31 @@ moment = Moment(app)
 app.config.from_object('config')
 db.init_app(app)
 migrate = Migrate(app, db)
+# Registered before CSRFProtect: before_request hooks run in order, and a
+# request CSRF rejects would otherwise never be counted or profiled
+metrics.init_app(app, db)
+profiler = Profiler(app, db)
 csrf = CSRFProtect(app)
+search_cache = SearchCache(
+  app.config['SEARCH_CACHE_SIZE'],
+  app.config['SEARCH_CACHE_TTL'],
+  app.config['SEARCH_CACHE_PREFIX_ROWS']
+)
+metrics.register_cache('search', search_cache.stats)
+match_engine = MatchEngine(db, Artist, Venue, app.config['MATCHES_INDEX_TTL'])
+if app.config['COMPRESS_RESPONSES']:
+  app.wsgi_app = CompressionMiddleware(app.wsgi_app)
+venue_summaries = SummaryCache(db, Venue, app.config['SUMMARY_CACHE_SIZE'], app.config['SUMMARY_CACHE_TTL'])
+artist_summaries = SummaryCache(db, Artist, app.config['SUMMARY_CACHE_SIZE'], app.config['SUMMARY_CACHE_TTL'])
+metrics.register_cache('venue_summary', venue_summaries.stats)
+metrics.register_cache('artist_summary', artist_summaries.stats)
+group_commit = None
+if app.config['GROUP_COMMIT']:
+  group_commit = GroupCommitWriter(
+    app, db,
+    app.config['GROUP_COMMIT_WINDOW_MS'] / 1000,
+    app.config['GROUP_COMMIT_MAX_BATCH']
+  )
 
 #----------------------------------------------------------------------------#
 # Filters.
@@ -40,6 +74,23 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Streaming.
+#----------------------------------------------------------------------------#
+
+# Rows fetched per round trip by the listings that stream
+STREAM_BATCH_SIZE = 500
+
+# The listing pages are sent while they render, from rows read lazily from
+# the database, so the time to first byte and the memory used do not grow
+# with the number of rows
+def stream_page(template_name, **context):
+  # The session cookie is saved before the body renders, so the flashed
+  # messages are taken out of it now; the template reads them from the
+  # request afterwards
+  get_flashed_messages()
+  return Response(buffered(stream_template(template_name, **context)), mimetype='text/html')
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -54,48 +105,66 @@ def context_processor():
 def index():
   return render_template('pages/home.html')
 
+# Adds the model built by `factory` and commits it, together with the inserts
+# of concurrent requests when group commit is enabled. Returns the instance.
+def commit_new(factory):
+  if group_commit is not None:
+    return group_commit.commit(factory, app.config['GROUP_COMMIT_TIMEOUT'])
+
+  instance = factory()
+  db.session.add(instance)
+  db.session.commit()
+  return instance
+
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
 def venues():
-  venues = Venue.query.all()
-  
-  venues_by_location = defaultdict(list)
-  
-  for venue in venues:
-    key = (venue.city, venue.state)
-    venues_by_location[key].append(venue)
-  
-  data = []
-  
-  for location, venues in venues_by_location.items():
-    data.append({
-      "city": location[0],
-      "state": location[1],
-      "venues": list(
-        map(
-          lambda venue: {
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": len(venue.shows),
-          },
-          venues
-        )
+  upcoming_shows = db.session.query(db.func.count(Show.id)) \
+    .filter(Show.venue_id == Venue.id, Show.start_time > datetime.now()) \
+    .correlate(Venue) \
+    .scalar_subquery()
+
+  # Venues come back sorted by location, so each area is a run of rows and
+  # no grouping over the whole table is needed. Rows are fetched in batches
+  # while the page streams out. Venues without a location (not backfilled,
+  # or with an unknown state) sort last and are listed together.
+  venues = db.session.query(Location.id, Location.city, Location.state, Venue.id, Venue.name, upcoming_shows) \
+    .outerjoin(Venue.location) \
+    .order_by(Location.state.nulls_last(), Location.city_key.nulls_last(), Venue.name) \
+    .yield_per(STREAM_BATCH_SIZE)
+
+  data = (
+    {
+      "location_id": location[0],
+      "city": location[1],
+      "state": location[2].value if location[2] is not None else None,
+      "venues": (
+        {
+          "id": row[3],
+          "name": row[4],
+          "num_upcoming_shows": row[5],
+        }
+        for row in rows
       )
-    })
+    }
+    for location, rows in groupby(venues, key=lambda row: row[:3])
+  )
 
-  return render_template('pages/venues.html', areas=data);
+  return stream_page('pages/venues.html', areas=data)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   search_term = request.form.get('search_term', '')
-  search_query = "%{}%".format(search_term.lower())
-  venues = Venue.query.filter(Venue.name.ilike(search_query)).all()
-
-  response = {
-    "count": len(venues),
-    "data": list(
+  term = normalize_term(search_term)
+  data = search_cache.get('venue', term)
+
+  if data is None:
+    generation = search_cache.generation('venue')
+    search_query = "%{}%".format(term)
+    venues = Venue.query.filter(Venue.name.ilike(search_query)).all()
+    data = list(
       map(
         lambda venue: {
           "id": venue.id,
@@ -105,20 +174,32 @@ def search_venues():
         venues
       )
     )
+    search_cache.put('venue', term, data, generation)
+
+  response = {
+    "count": len(data),
+    "data": data
   }
 
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
-  venue = Venue.query.get(venue_id)
+  venue = Venue.query.options(db.noload(Venue.shows)).get(venue_id)
 
   if venue is None:
       abort(404)
 
+  shows = db.session.query(Show.artist_id, Show.start_time) \
+    .filter(Show.venue_id == venue_id) \
+    .order_by(Show.start_time) \
+    .all()
+  artists = artist_summaries.get_many([show.artist_id for show in shows])
+  shows = [show for show in shows if show.artist_id in artists]
+
   current_time = datetime.now()
-  upcoming_shows = [show for show in venue.shows if show.start_time > current_time]
-  past_shows = [show for show in venue.shows if show.start_time <= current_time]
+  upcoming_shows = [show for show in shows if show.start_time > current_time]
+  past_shows = [show for show in shows if show.start_time <= current_time]
 
   data={
     "id": venue.id,
@@ -136,9 +217,9 @@ def show_venue(venue_id):
     "past_shows": list(
       map(
         lambda show: {
-          "artist_id": show.artist.id,
-          "artist_name": show.artist.name,
-          "artist_image_link": show.artist.image_link,
+          "artist_id": show.artist_id,
+          "artist_name": artists[show.artist_id].name,
+          "artist_image_link": artists[show.artist_id].image_link,
           "start_time": show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
         },
         past_shows
@@ -147,9 +228,9 @@ def show_venue(venue_id):
     "upcoming_shows": list(
       map(
         lambda show: {
-          "artist_id": show.artist.id,
-          "artist_name": show.artist.name,
-          "artist_image_link": show.artist.image_link,
+          "artist_id": show.artist_id,
+          "artist_name": artists[show.artist_id].name,
+          "artist_image_link": artists[show.artist_id].image_link,
           "start_time": show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
         },
         upcoming_shows
@@ -161,6 +242,66 @@ def show_venue(venue_id):
 
   return render_template('pages/show_venue.html', venue=data)
 
+#  Locations
+#  ----------------------------------------------------------------
+
+@app.route('/locations')
+def locations():
+  # Counts are read from the indexed location_id foreign keys
+  venues_count = dict(
+    db.session.query(Venue.location_id, db.func.count(Venue.id)).group_by(Venue.location_id).all()
+  )
+  artists_count = dict(
+    db.session.query(Artist.location_id, db.func.count(Artist.id)).group_by(Artist.location_id).all()
+  )
+
+  data = list(
+    map(
+      lambda location: {
+        "id": location.id,
+        "city": location.city,
+        "state": location.state.value,
+        "venues_count": venues_count.get(location.id, 0),
+        "artists_count": artists_count.get(location.id, 0),
+      },
+      # Edits and deletes can leave a location unused, those are not listed
+      Location.query
+        .filter(db.or_(Location.venues.any(), Location.artists.any()))
+        .order_by(Location.state, Location.city_key)
+        .all()
+    )
+  )
+
+  return render_template('pages/locations.html', locations=data)
+
+@app.route('/locations/<int:location_id>')
+def show_location(location_id):
+  location = Location.query.get(location_id)
+
+  if location is None:
+      abort(404)
+
+  venues = db.session.query(Venue.id, Venue.name) \
+    .filter(Venue.location_id == location_id) \
+    .order_by(Venue.name) \
+    .all()
+  artists = db.session.query(Artist.id, Artist.name) \
+    .filter(Artist.location_id == location_id) \
+    .order_by(Artist.name) \
+    .all()
+
+  data = {
+    "id": location.id,
+    "city": location.city,
+    "state": location.state.value,
+    "venues": [{"id": id, "name": name} for id, name in venues],
+    "artists": [{"id": id, "name": name} for id, name in artists],
+    "venues_count": len(venues),
+    "artists_count": len(artists),
+  }
+
+  return render_template('pages/show_location.html', location=data)
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -186,10 +327,13 @@ def create_venue_submission():
         image_link=form.image_link.data,
         website_link=form.website_link.data,
         seeking_talent=form.seeking_talent.data,
-        seeking_description=form.seeking_description.data
+        seeking_description=form.seeking_description.data,
+        location=Location.get_or_create(form.city.data, form.state.data)
       )
       db.session.add(venue)
       db.session.commit()
+      search_cache.invalidate('venue')
+      match_engine.update_venue(venue)
       flash('Venue ' + venue.name + ' was successfully listed!')
       return redirect(url_for('index'))
     except Exception as e:
@@ -214,6 +358,10 @@ def delete_venue(venue_id):
 
     db.session.delete(venue)
     db.session.commit()
+    # The venue's shows are deleted with it, artist results count them
+    search_cache.invalidate('venue', 'artist')
+    match_engine.remove_venue(int(venue_id))
+    venue_summaries.invalidate(int(venue_id))
 
   except Exception as e:
     abort(500)
@@ -226,30 +374,32 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-  artists = Artist.query.all()
-
-  data = list(
-    map(
-      lambda artist: {
-        "id": artist.id,
-        "name": artist.name,
-      },
-      artists
-    )
+  artists = db.session.query(Artist.id, Artist.name) \
+    .order_by(Artist.id) \
+    .yield_per(STREAM_BATCH_SIZE)
+
+  data = (
+    {
+      "id": artist.id,
+      "name": artist.name,
+    }
+    for artist in artists
   )
 
-  return render_template('pages/artists.html', artists=data)
+  return stream_page('pages/artists.html', artists=data)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   search_term = request.form.get('search_term', '')
-  search_query = "%{}%".format(search_term.lower())
-  artists = Artist.query.filter(Artist.name.ilike(search_query)).all()
-  current_time = datetime.now()
-
-  response = {
-    "count": len(artists),
-    "data": list(
+  term = normalize_term(search_term)
+  data = search_cache.get('artist', term)
+
+  if data is None:
+    generation = search_cache.generation('artist')
+    search_query = "%{}%".format(term)
+    artists = Artist.query.filter(Artist.name.ilike(search_query)).all()
+    current_time = datetime.now()
+    data = list(
       map(
         lambda artist: {
           "id": artist.id,
@@ -259,20 +409,32 @@ def search_artists():
         artists
       )
     )
+    search_cache.put('artist', term, data, generation)
+
+  response = {
+    "count": len(data),
+    "data": data
   }
 
   return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-  artist = Artist.query.get(artist_id)
+  artist = Artist.query.options(db.noload(Artist.shows)).get(artist_id)
 
   if artist is None:
       abort(404)
-  
+
+  shows = db.session.query(Show.venue_id, Show.start_time) \
+    .filter(Show.artist_id == artist_id) \
+    .order_by(Show.start_time) \
+    .all()
+  venues = venue_summaries.get_many([show.venue_id for show in shows])
+  shows = [show for show in shows if show.venue_id in venues]
+
   current_time = datetime.now()
-  upcoming_shows = [show for show in artist.shows if show.start_time > current_time]
-  past_shows = [show for show in artist.shows if show.start_time <= current_time]
+  upcoming_shows = [show for show in shows if show.start_time > current_time]
+  past_shows = [show for show in shows if show.start_time <= current_time]
 
   data={
     "id": artist.id,
@@ -289,9 +451,9 @@ def show_artist(artist_id):
      "past_shows": list(
       map(
         lambda show: {
-          "venue_id": show.venue.id,
-          "venue_name": show.venue.name,
-          "venue_image_link": show.venue.image_link,
+          "venue_id": show.venue_id,
+          "venue_name": venues[show.venue_id].name,
+          "venue_image_link": venues[show.venue_id].image_link,
           "start_time": show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
         },
         past_shows
@@ -300,9 +462,9 @@ def show_artist(artist_id):
     "upcoming_shows": list(
       map(
         lambda show: {
-          "venue_id": show.venue.id,
-          "venue_name": show.venue.name,
-          "venue_image_link": show.venue.image_link,
+          "venue_id": show.venue_id,
+          "venue_name": venues[show.venue_id].name,
+          "venue_image_link": venues[show.venue_id].image_link,
           "start_time": show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
         },
         upcoming_shows
@@ -314,6 +476,64 @@ def show_artist(artist_id):
 
   return render_template('pages/show_artist.html', artist=data)
 
+#  Matches
+#  ----------------------------------------------------------------
+
+def match_data(model, matches, genres):
+  rows = db.session.query(model.id, model.name, model.image_link, model.genres, model.city, model.state) \
+    .filter(model.id.in_([id for id, shared, locality in matches])) \
+    .all()
+  rows = {row.id: row for row in rows}
+  genres = set(genres)
+
+  return [
+    {
+      "id": id,
+      "name": rows[id].name,
+      "image_link": rows[id].image_link,
+      "city": rows[id].city,
+      "state": rows[id].state,
+      "shared_genres": [genre for genre in rows[id].genres if genre in genres],
+      "same_location": locality == 2,
+    }
+    for id, shared, locality in matches
+    if id in rows
+  ]
+
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+  venue = Venue.query.options(db.noload(Venue.shows)).get(venue_id)
+
+  if venue is None:
+      abort(404)
+
+  matches = match_engine.artists_for_venue(venue, app.config['MATCHES_LIMIT'])
+  data = {
+    "name": venue.name,
+    "link": url_for('show_venue', venue_id=venue.id),
+    "kind": "artists",
+    "matches": match_data(Artist, matches, venue.genres),
+  }
+
+  return render_template('pages/matches.html', subject=data)
+
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+  artist = Artist.query.options(db.noload(Artist.shows)).get(artist_id)
+
+  if artist is None:
+      abort(404)
+
+  matches = match_engine.venues_for_artist(artist, app.config['MATCHES_LIMIT'])
+  data = {
+    "name": artist.name,
+    "link": url_for('show_artist', artist_id=artist.id),
+    "kind": "venues",
+    "matches": match_data(Venue, matches, artist.genres),
+  }
+
+  return render_template('pages/matches.html', subject=data)
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
@@ -358,8 +578,12 @@ def edit_artist_submission(artist_id):
       artist.website_link = form.website_link.data
       artist.seeking_venue = form.seeking_venue.data
       artist.seeking_description = form.seeking_description.data
+      artist.location = Location.get_or_create(form.city.data, form.state.data)
     
       db.session.commit()
+      search_cache.invalidate('artist')
+      match_engine.update_artist(artist)
+      artist_summaries.invalidate(artist_id)
       flash('Artist ' + artist.name + ' was successfully updated!')
       return redirect(url_for('show_artist', artist_id=artist_id))
     except Exception as e:
@@ -419,8 +643,12 @@ def edit_venue_submission(venue_id):
       venue.website_link = form.website_link.data
       venue.seeking_talent = form.seeking_talent.data
       venue.seeking_description = form.seeking_description.data
+      venue.location = Location.get_or_create(form.city.data, form.state.data)
     
       db.session.commit()
+      search_cache.invalidate('venue')
+      match_engine.update_venue(venue)
+      venue_summaries.invalidate(venue_id)
       flash('Venue ' + venue.name + ' was successfully updated!')
       return redirect(url_for('show_venue', venue_id=venue_id))
     except Exception as e:
@@ -450,7 +678,7 @@ def create_artist_submission():
 
   if form.validate():
     try:
-      artist = Artist(
+      artist = commit_new(lambda: Artist(
         name=form.name.data,
         city=form.city.data,
         state=form.state.data,
@@ -460,10 +688,11 @@ def create_artist_submission():
         image_link=form.image_link.data,
         website_link=form.website_link.data,
         seeking_venue=form.seeking_venue.data,
-        seeking_description=form.seeking_description.data
-      )
-      db.session.add(artist)
-      db.session.commit()
+        seeking_description=form.seeking_description.data,
+        location=Location.get_or_create(form.city.data, form.state.data)
+      ))
+      search_cache.invalidate('artist')
+      match_engine.update_artist(artist)
       flash('Artist ' + artist.name + ' was successfully listed!')
       return redirect(url_for('index'))
     except Exception as e:
@@ -484,24 +713,32 @@ def create_artist_submission():
 
 @app.route('/shows')
 def shows():
-  shows = Show.query.all()
-
-  data = list(
-    map(
-      lambda show: {
-        "venue_id": show.venue.id,
-        "venue_name": show.venue.name,
-        "artist_id": show.artist.id,
-        "artist_name": show.artist.name,
-        "artist_image_link": show.artist.image_link,
-        # "2035-04-01T20:00:00.000Z"
-        "start_time": show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-      },
-      shows
-    )
+  shows = db.session.execute(
+    db.select(Show.venue_id, Show.artist_id, Show.start_time)
+      .order_by(Show.start_time)
+      .execution_options(yield_per=STREAM_BATCH_SIZE)
   )
 
-  return render_template('pages/shows.html', shows=data)
+  # Each batch of shows is completed with the venue and artist summaries,
+  # read from the caches or with one query per batch for the misses
+  def hydrate(shows):
+    for batch in shows.partitions():
+      venues = venue_summaries.get_many([show.venue_id for show in batch])
+      artists = artist_summaries.get_many([show.artist_id for show in batch])
+      for show in batch:
+        if show.venue_id not in venues or show.artist_id not in artists:
+          continue
+        yield {
+          "venue_id": show.venue_id,
+          "venue_name": venues[show.venue_id].name,
+          "artist_id": show.artist_id,
+          "artist_name": artists[show.artist_id].name,
+          "artist_image_link": artists[show.artist_id].image_link,
+          # "2035-04-01T20:00:00.000Z"
+          "start_time": show.start_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+        }
+
+  return stream_page('pages/shows.html', shows=hydrate(shows))
  
 @app.route('/shows/create')
 def create_show():
@@ -515,14 +752,13 @@ def create_show_submission():
 
   if form.validate():
     try:
-      show = Show(
+      commit_new(lambda: Show(
         venue_id=form.venue_id.data,
         artist_id=form.artist_id.data,
         start_time=form.start_time.data
-      )
-      db.session.add(show)
-    
-      db.session.commit()
+      ))
+      # Search results carry upcoming show counts
+      search_cache.invalidate('venue', 'artist')
       flash('Show was successfully listed!')
       return redirect(url_for('index'))
     except Exception as e:
@@ -538,6 +774,162 @@ def create_show_submission():
     
   return redirect(url_for('create_show'))
 
+#  Analytics
+#  ----------------------------------------------------------------
+
+@app.route('/analytics')
+def show_analytics():
+  # Reads the rollups only, the analytics-refresh command keeps them current
+  today = date.today()
+  quarter = analytics.quarter_start(today)
+  quarter_end = analytics.add_months(quarter, 3)
+  first_month = analytics.add_months(today, -11)
+  months = [analytics.add_months(first_month, n) for n in range(12)]
+
+  top_venues = analytics.top('venue', quarter, quarter_end)
+  top_artists = analytics.top('artist', quarter, quarter_end)
+  venue_names = dict(
+    db.session.query(Venue.id, Venue.name).filter(Venue.id.in_([int(key) for key, count in top_venues])).all()
+  )
+  artist_names = dict(
+    db.session.query(Artist.id, Artist.name).filter(Artist.id.in_([int(key) for key, count in top_artists])).all()
+  )
+  genres = analytics.monthly('genre', first_month, analytics.add_months(today, 1))
+
+  data = {
+    "quarter": "Q{} {}".format((quarter.month - 1) // 3 + 1, quarter.year),
+    "venues": [
+      {"id": int(key), "name": venue_names.get(int(key), 'Deleted venue'), "count": count}
+      for key, count in top_venues
+    ],
+    "artists": [
+      {"id": int(key), "name": artist_names.get(int(key), 'Deleted artist'), "count": count}
+      for key, count in top_artists
+    ],
+    "states": [
+      {"state": key, "count": count}
+      for key, count in analytics.top('state', quarter, quarter_end)
+    ],
+    "months": [month.strftime('%b %Y') for month in months],
+    "genres": [
+      {"genre": genre, "counts": [counts.get(month, 0) for month in months]}
+      for genre, counts in sorted(genres.items(), key=lambda item: -sum(item[1].values()))
+    ],
+  }
+
+  return render_template('pages/analytics.html', analytics=data)
+
+#  Status
+#  ----------------------------------------------------------------
+
+# Used by loadtest.py to follow DB pool saturation while it generates traffic
+@app.route('/status')
+def status():
+  pool = db.engine.pool
+  return jsonify({
+    "pool": {
+      "size": pool.size(),
+      "checked_in": pool.checkedin(),
+      "checked_out": pool.checkedout(),
+      "overflow": max(pool.overflow(), 0),
+    },
+    "search_cache": search_cache.stats(),
+    "venue_summary_cache": venue_summaries.stats(),
+    "artist_summary_cache": artist_summaries.stats(),
+  })
+
+# Prometheus scrape target, see metrics.py for what is collected
+@app.route('/metrics')
+def show_metrics():
+  return Response(metrics.registry.render(), mimetype=metrics.CONTENT_TYPE)
+
+#  Profiles
+#  ----------------------------------------------------------------
+
+# Only reachable with the PROFILE_TOKEN, see profiling.py
+@app.route('/admin/profiles')
+def profiles():
+  if not profiler.is_admin():
+    abort(404)
+
+  return render_template('pages/profiles.html', reports=profiler.list(), token=profiler.link_token())
+
+@app.route('/admin/profiles/<int:report_id>')
+def profile_report(report_id):
+  report = profiler.get(report_id) if profiler.is_admin() else None
+
+  if report is None:
+    abort(404)
+
+  return render_template('pages/profile.html', report=report)
+
+#  Tours
+#  ----------------------------------------------------------------
+
+@app.route('/shows/tour')
+def create_tour():
+  form = TourForm()
+  return render_template('forms/new_tour.html', form=form)
+
+@app.route('/shows/tour', methods=['POST'])
+def create_tour_submission():
+  form = TourForm(request.form)
+  dates = []
+
+  if form.validate():
+    dates = parse_tour_lines(form.dates.data)
+    try:
+      created = book_tour(form.artist_id.data, dates)
+      if created:
+        search_cache.invalidate('venue', 'artist')
+      flash('{} of {} shows were successfully listed!'.format(created, len(dates)))
+    except Exception as e:
+      print(e)
+      db.session.rollback()
+      for tour_date in dates:
+        tour_date.show_id = None
+        tour_date.error = tour_date.error or 'An error occurred. Show could not be listed.'
+      flash('An error occurred. The tour could not be listed.')
+  else:
+    message = []
+    for field, errors in form.errors.items():
+      for error in errors:
+        message.append(f"{field}: {error}")
+    flash('Please fix the following errors: ' + ','.join(message))
+
+  return render_template('forms/new_tour.html', form=form, results=[tour_date.to_dict() for tour_date in dates])
+
+# JSON version of the tour form:
+# {"artist_id": 1, "shows": [{"venue_id": 2, "start_time": "2035-04-01 20:00"}, ...]}
+# Exempt from CSRF as it only accepts application/json, which a cross-site
+# form cannot send
+@app.route('/api/shows/tour', methods=['POST'])
+@csrf.exempt
+def create_tour_json():
+  payload = request.get_json(silent=True)
+
+  if not isinstance(payload, dict) or not isinstance(payload.get('shows'), list):
+    return jsonify({"error": "Expected a JSON object with artist_id and a list of shows."}), 400
+
+  dates = [
+    parse_tour_date(show.get('venue_id'), show.get('start_time')) if isinstance(show, dict)
+    else parse_tour_date(None, None)
+    for show in payload['shows']
+  ]
+  try:
+    created = book_tour(payload.get('artist_id'), dates)
+    if created:
+      search_cache.invalidate('venue', 'artist')
+  except Exception as e:
+    print(e)
+    db.session.rollback()
+    return jsonify({"error": "An error occurred. The tour could not be listed."}), 500
+
+  return jsonify({
+    "created": created,
+    "results": [tour_date.to_dict() for tour_date in dates],
+  })
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -556,6 +948,42 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+# Links the venues and artists created before the Location table existed:
+# flask --app app backfill-locations
+@app.cli.command('backfill-locations')
+def backfill_locations():
+  for model in (Venue, Artist):
+    pairs = db.session.query(model.city, model.state) \
+      .filter(model.location_id.is_(None)) \
+      .distinct() \
+      .all()
+    for city, state in pairs:
+      if state not in State.__members__:
+        print('Skipping {} {}, {}: unknown state'.format(model.__tablename__, city, state))
+        continue
+      location = Location.get_or_create(city, state)
+      model.query \
+        .filter(model.location_id.is_(None), model.city == city, model.state == state) \
+        .update({model.location_id: location.id}, synchronize_session=False)
+    db.session.commit()
+    print('{}: linked {} city/state pairs'.format(model.__tablename__, len(pairs)))
+
+# Adds new shows to the analytics rollups, eg. from cron:
+# flask --app app analytics-refresh
+@app.cli.command('analytics-refresh')
+def analytics_refresh():
+  print('Added {} shows to the rollups'.format(analytics.refresh()))
+
+# Recounts the rollups from scratch, after shows were deleted
+@app.cli.command('analytics-rebuild')
+def analytics_rebuild():
+  analytics.rebuild()
+  print('Rebuilt the rollups')
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
@@ -0,0 +1,127 @@
+from datetime import datetime
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert
+from models import db, Artist, Venue, Show
+
+class TourDate:
+  """One requested show of a tour and what became of it."""
+
+  def __init__(self, venue_id, start_time, error=None):
+    self.venue_id = venue_id
+    self.start_time = start_time
+    self.error = error
+    self.show_id = None
+
+  def to_dict(self):
+    return {
+      "venue_id": self.venue_id,
+      "start_time": self.start_time.isoformat() if isinstance(self.start_time, datetime) else self.start_time,
+      "status": "created" if self.show_id is not None else "rejected",
+      "show_id": self.show_id,
+      "error": self.error,
+    }
+
+def parse_tour_date(venue_id, start_time):
+  """Builds a TourDate from raw input, recording what is wrong with it."""
+  try:
+    venue_id = int(venue_id)
+  except (TypeError, ValueError):
+    return TourDate(venue_id, start_time, 'Invalid venue id.')
+  try:
+    start_time = datetime.fromisoformat(str(start_time).strip())
+  except ValueError:
+    return TourDate(venue_id, start_time, 'Invalid start time, expected YYYY-MM-DD HH:MM.')
+  if start_time.tzinfo is not None:
+    # Shows are stored in naive local time
+    start_time = start_time.astimezone().replace(tzinfo=None)
+  return TourDate(venue_id, start_time)
+
+def parse_tour_lines(text):
+  """Parses one "venue_id, YYYY-MM-DD HH:MM" pair per line."""
+  dates = []
+  for line in text.splitlines():
+    if not line.strip():
+      continue
+    venue_id, _, start_time = line.partition(',')
+    dates.append(parse_tour_date(venue_id.strip(), start_time))
+  return dates
+
+def book_tour(artist_id, dates):
+  """Creates a show for each valid TourDate of the artist in one transaction.
+
+  The checks run as a few set based queries over the whole tour: that the
+  artist and venues exist, and that neither the venue nor the artist already
+  has a show at that time. Valid dates are inserted with a single multi-row
+  INSERT. Returns the number of shows created; each TourDate gets either a
+  show_id or an error.
+
+  The checks give precise errors, the unique constraints on Show settle
+  races with concurrent bookings: conflicting rows are skipped by ON
+  CONFLICT DO NOTHING and reported as taken.
+  """
+  candidates = [date for date in dates if date.error is None]
+  if not candidates:
+    return 0
+
+  try:
+    artist_id = int(artist_id)
+  except (TypeError, ValueError):
+    for date in candidates:
+      date.error = 'Invalid artist id.'
+    return 0
+
+  if db.session.query(Artist.id).filter(Artist.id == artist_id).first() is None:
+    for date in candidates:
+      date.error = 'Artist {} does not exist.'.format(artist_id)
+    return 0
+
+  venue_ids = set(date.venue_id for date in candidates)
+  start_times = set(date.start_time for date in candidates)
+  existing_venues = set(
+    id for id, in db.session.query(Venue.id).filter(Venue.id.in_(venue_ids))
+  )
+  booked_venues = set(
+    db.session.query(Show.venue_id, Show.start_time)
+      .filter(tuple_(Show.venue_id, Show.start_time).in_([(date.venue_id, date.start_time) for date in candidates]))
+      .all()
+  )
+  booked_artist = set(
+    start_time for start_time, in db.session.query(Show.start_time)
+      .filter(Show.artist_id == artist_id, Show.start_time.in_(start_times))
+  )
+
+  valid = []
+  for date in candidates:
+    if date.venue_id not in existing_venues:
+      date.error = 'Venue {} does not exist.'.format(date.venue_id)
+    elif (date.venue_id, date.start_time) in booked_venues:
+      date.error = 'Venue {} already has a show at that time.'.format(date.venue_id)
+    elif date.start_time in booked_artist:
+      date.error = 'The artist already has a show at that time.'
+    else:
+      valid.append(date)
+      # Later dates of the same tour conflict with this one too
+      booked_venues.add((date.venue_id, date.start_time))
+      booked_artist.add(date.start_time)
+
+  if not valid:
+    return 0
+
+  rows = db.session.execute(
+    insert(Show)
+      .values([
+        {"artist_id": artist_id, "venue_id": date.venue_id, "start_time": date.start_time}
+        for date in valid
+      ])
+      .on_conflict_do_nothing()
+      .returning(Show.id, Show.venue_id, Show.start_time)
+  ).all()
+  db.session.commit()
+
+  show_ids = {(venue_id, start_time): id for id, venue_id, start_time in rows}
+  for date in valid:
+    date.show_id = show_ids.get((date.venue_id, date.start_time))
+    if date.show_id is None:
+      # Booked by a concurrent request since the checks ran
+      date.error = 'The venue or the artist already has a show at that time.'
+  return len(rows)
@@ -15,3 +15,43 @@ SECRET_KEY = 'example-secret-key'
 SQLALCHEMY_ECHO = True
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Search result cache: max entries, seconds an entry stays valid, and the
+# largest cached result set a longer search term may be filtered from
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL = 60
+SEARCH_CACHE_PREFIX_ROWS = 200
+
+# Number of candidates listed on the venue and artist matches pages, and
+# seconds before the in-process match indexes are rebuilt from the database
+MATCHES_LIMIT = 10
+MATCHES_INDEX_TTL = 300
+
+# Request profiling, see profiling.py. Requests sending PROFILE_TOKEN in the
+# X-Profile header or the _profile query parameter are profiled, as well as
+# a PROFILE_SAMPLE_RATE fraction of all requests. Leave the token unset and
+# the rate at 0 to switch profiling off entirely.
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_SLOW_QUERY_MS = 50
+PROFILE_REPORTS = 50
+
+# Gzip (or brotli, when installed) responses for clients that accept it
+COMPRESS_RESPONSES = True
+
+# Group commit: artist and show inserts of concurrent requests are committed
+# together by a background thread, which waits up to GROUP_COMMIT_WINDOW_MS
+# for up to GROUP_COMMIT_MAX_BATCH inserts. Requests give up after
+# GROUP_COMMIT_TIMEOUT seconds if their insert has not started by then.
+# Set GROUP_COMMIT=1 in the environment to enable it.
+GROUP_COMMIT = os.environ.get('GROUP_COMMIT') == '1'
+GROUP_COMMIT_WINDOW_MS = 5
+GROUP_COMMIT_MAX_BATCH = 64
+GROUP_COMMIT_TIMEOUT = 10
+
+# Caches of the venue and artist fields listed next to shows: max entries
+# per model and seconds an entry stays valid. Edits only invalidate the
+# cache of the process handling them, others may serve a renamed venue or
+# artist for up to SUMMARY_CACHE_TTL.
+SUMMARY_CACHE_SIZE = 10000
+SUMMARY_CACHE_TTL = 300
@@ -1,6 +1,6 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, ValidationError
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, TextAreaField, ValidationError
 from wtforms.validators import DataRequired, AnyOf, URL, Optional
 from enums import Genre, State
 import re
@@ -36,6 +36,17 @@ class ShowForm(FlaskForm):
         default= datetime.today()
     )
 
+class TourForm(FlaskForm):
+    artist_id = StringField(
+        'artist_id',
+        validators=[DataRequired()],
+    )
+    # One "venue_id, YYYY-MM-DD HH:MM" pair per line
+    dates = TextAreaField(
+        'dates',
+        validators=[DataRequired()],
+    )
+
 class VenueForm(FlaskForm):
     name = StringField(
         'name', validators=[DataRequired()]
@@ -0,0 +1,116 @@
+import queue
+import threading
+import time
+from concurrent import futures
+import metrics
+
+def _fail(future, error):
+  try:
+    future.set_exception(error)
+  except futures.InvalidStateError:
+    # Already resolved or cancelled
+    pass
+
+class GroupCommitWriter:
+  """Commits the inserts of concurrent requests together.
+
+  Requests hand a factory building the new model to submit() and wait on
+  the returned Future. A background thread takes the first pending insert,
+  keeps collecting for up to `window` seconds or `max_batch` inserts, and
+  adds them all in one transaction: one commit, so one WAL flush, for the
+  whole batch. Each insert runs in its own savepoint, so a failing one only
+  fails its own request.
+
+  Factories run in the writer thread, inside its session, and may use
+  db.session (eg. Location.get_or_create). The Future resolves to the
+  committed instance, detached with its attributes loaded.
+  """
+
+  def __init__(self, app, db, window=0.005, max_batch=64):
+    self.app = app
+    self.db = db
+    self.window = window
+    self.max_batch = max_batch
+    self._queue = queue.Queue()
+    self._thread = None
+    self._lock = threading.Lock()
+
+  def submit(self, factory):
+    future = futures.Future()
+    self._queue.put((factory, future))
+    self._start()
+    return future
+
+  def commit(self, factory, timeout=None):
+    """Submits `factory` and waits for the committed instance.
+
+    Gives up after `timeout` seconds only when the insert has not started:
+    the cancelled insert is then never run. Once it is running its outcome
+    is awaited, so a request reported as failed never leaves a row behind.
+    """
+    future = self.submit(factory)
+    try:
+      return future.result(timeout)
+    except futures.TimeoutError:
+      if future.cancel():
+        raise
+      return future.result()
+
+  def _start(self):
+    # Started on first use rather than at import, so each worker process of
+    # a pre-forking server gets its own thread. Also restarts a thread that
+    # died, so inserts never wait on a writer that is gone.
+    if self._thread is not None and self._thread.is_alive():
+      return
+    with self._lock:
+      if self._thread is None or not self._thread.is_alive():
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+
+  def _run(self):
+    while True:
+      batch = [self._queue.get()]
+      try:
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+          timeout = deadline - time.monotonic()
+          if timeout <= 0:
+            break
+          try:
+            batch.append(self._queue.get(timeout=timeout))
+          except queue.Empty:
+            break
+        metrics.group_commit_batch.observe(len(batch))
+        self._commit(batch)
+      except Exception as e:
+        # Eg. the rollback failing on a dead connection: fails this batch and
+        # keeps the thread serving the next ones
+        self.app.logger.exception('Group commit batch failed')
+        for factory, future in batch:
+          _fail(future, e)
+
+  def _commit(self, batch):
+    with self.app.app_context():
+      session = self.db.session()
+      # Keeps the attributes loaded, the requests read them after the commit
+      session.expire_on_commit = False
+      added = []
+      try:
+        for factory, future in batch:
+          if not future.set_running_or_notify_cancel():
+            continue
+          try:
+            with session.begin_nested():
+              instance = factory()
+              session.add(instance)
+            added.append((future, instance))
+          except Exception as e:
+            future.set_exception(e)
+        session.commit()
+      except Exception as e:
+        session.rollback()
+        for future, instance in added:
+          future.set_exception(e)
+        return
+      for future, instance in added:
+        future.set_result(instance)
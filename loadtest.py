@@ -0,0 +1,432 @@
+#----------------------------------------------------------------------------#
+# Load testing harness for a running Fyyur instance.
+#
+# Usage:
+#   python loadtest.py --url http://127.0.0.1:5000 --profile browse \
+#     --workers 16 --duration 60
+#
+# Each worker keeps its own cookie session (so CSRF tokens stay valid for that
+# session) and picks operations at random according to the weights of the
+# selected traffic profile. A progress line is printed every --interval
+# seconds and a per-operation summary is printed at the end.
+#----------------------------------------------------------------------------#
+
+import argparse
+import http.cookiejar
+import json
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+
+#----------------------------------------------------------------------------#
+# Traffic profiles.
+#----------------------------------------------------------------------------#
+
+# Relative weights of the operations defined below.
+PROFILES = {
+  'browse': {
+    'home': 5,
+    'list_venues': 20,
+    'list_artists': 15,
+    'list_shows': 15,
+    'show_venue': 20,
+    'show_artist': 15,
+    'search_venues': 4,
+    'search_artists': 4,
+    'create_show': 1,
+    'edit_venue': 1,
+  },
+  'search': {
+    'search_venues': 40,
+    'search_artists': 40,
+    'show_venue': 10,
+    'show_artist': 10,
+  },
+  'booking': {
+    'create_show': 50,
+    'show_venue': 20,
+    'show_artist': 10,
+    'list_shows': 10,
+    'edit_venue': 10,
+  },
+  # Inserts only, to compare per-request commits with GROUP_COMMIT=1
+  'writes': {
+    'create_show': 50,
+    'create_artist': 50,
+  },
+}
+
+SEARCH_TERMS = ['a', 'the', 'music', 'hall', 'club', 'band', 'jazz', 'rock', 'park', 'guns', 'sax']
+
+CSRF_ERROR = 'The CSRF token'
+
+#----------------------------------------------------------------------------#
+# HTTP client.
+#----------------------------------------------------------------------------#
+
+class FormParser(HTMLParser):
+  """Collects the current values of the fields of the first form on a page."""
+
+  def __init__(self):
+    super().__init__()
+    self.fields = []
+    self._in_form = False
+    self._done = False
+    self._select = None
+    self._textarea = None
+
+  def handle_starttag(self, tag, attrs):
+    attrs = dict(attrs)
+    if tag == 'form' and not self._done:
+      self._in_form = True
+    if not self._in_form:
+      return
+    name = attrs.get('name')
+    if tag == 'input' and name:
+      kind = attrs.get('type', 'text')
+      if kind in ('checkbox', 'radio'):
+        if 'checked' in attrs:
+          self.fields.append((name, attrs.get('value', 'y')))
+      elif kind != 'submit':
+        self.fields.append((name, attrs.get('value') or ''))
+    elif tag == 'select' and name:
+      self._select = name
+    elif tag == 'option' and self._select and 'selected' in attrs:
+      self.fields.append((self._select, attrs.get('value', '')))
+    elif tag == 'textarea' and name:
+      self._textarea = name
+      self.fields.append((name, ''))
+
+  def handle_data(self, data):
+    if self._textarea:
+      name, value = self.fields[-1]
+      self.fields[-1] = (name, value + data)
+
+  def handle_endtag(self, tag):
+    if tag == 'select':
+      self._select = None
+    elif tag == 'textarea':
+      self._textarea = None
+    elif tag == 'form' and self._in_form:
+      self._in_form = False
+      self._done = True
+
+def parse_form(html):
+  parser = FormParser()
+  parser.feed(html)
+  return parser.fields
+
+class Client:
+  """One browser-like session: cookies, CSRF token and a base url."""
+
+  def __init__(self, base_url, timeout):
+    self.base_url = base_url.rstrip('/')
+    self.timeout = timeout
+    self.opener = urllib.request.build_opener(
+      urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+    )
+    self.token = None
+
+  def request(self, path, data=None):
+    body = None
+    if data is not None:
+      body = urllib.parse.urlencode(data, doseq=True).encode()
+    req = urllib.request.Request(self.base_url + path, data=body)
+    try:
+      with self.opener.open(req, timeout=self.timeout) as response:
+        return response.status, response.read().decode('utf-8', 'replace'), response.geturl()
+    except urllib.error.HTTPError as e:
+      return e.code, e.read().decode('utf-8', 'replace'), e.geturl()
+
+  def get(self, path):
+    return self.request(path)
+
+  def post(self, path, data):
+    """Posts a form, fetching a CSRF token for the session first if needed."""
+    if self.token is None:
+      self.refresh_token()
+    status, body, url = self.request(path, dict(data, csrf_token=self.token))
+    if status == 400 and CSRF_ERROR in body:
+      # The session expired or rotated, retry once with a fresh token.
+      self.refresh_token()
+      status, body, url = self.request(path, dict(data, csrf_token=self.token))
+    return status, body, url
+
+  def refresh_token(self):
+    # The search form is rendered on the listing pages and shares the
+    # session-wide token with every other form.
+    status, body, url = self.get('/venues')
+    self.token = dict(parse_form(body)).get('csrf_token', '')
+
+#----------------------------------------------------------------------------#
+# Operations.
+#----------------------------------------------------------------------------#
+
+# Each operation returns (status, ok). `ok` is False for responses that were
+# not HTTP errors but still did not do what was asked (eg. a rejected form).
+
+def op_home(client, catalog):
+  status, body, url = client.get('/')
+  return status, status == 200
+
+def op_list_venues(client, catalog):
+  status, body, url = client.get('/venues')
+  return status, status == 200
+
+def op_list_artists(client, catalog):
+  status, body, url = client.get('/artists')
+  return status, status == 200
+
+def op_list_shows(client, catalog):
+  status, body, url = client.get('/shows')
+  return status, status == 200
+
+def op_show_venue(client, catalog):
+  status, body, url = client.get('/venues/{}'.format(random.choice(catalog.venue_ids)))
+  return status, status == 200
+
+def op_show_artist(client, catalog):
+  status, body, url = client.get('/artists/{}'.format(random.choice(catalog.artist_ids)))
+  return status, status == 200
+
+def op_search_venues(client, catalog):
+  status, body, url = client.post('/venues/search', {'search_term': random.choice(SEARCH_TERMS)})
+  return status, status == 200
+
+def op_search_artists(client, catalog):
+  status, body, url = client.post('/artists/search', {'search_term': random.choice(SEARCH_TERMS)})
+  return status, status == 200
+
+def op_create_show(client, catalog):
+  start_time = datetime.now() + timedelta(days=random.randint(1, 365), hours=random.randint(0, 23))
+  status, body, url = client.post('/shows/create', {
+    'artist_id': random.choice(catalog.artist_ids),
+    'venue_id': random.choice(catalog.venue_ids),
+    'start_time': start_time.strftime('%Y-%m-%d %H:00:00'),
+  })
+  # A successful submission redirects to the home page, a rejected one back
+  # to the form.
+  return status, status == 200 and not url.endswith('/shows/create')
+
+def op_create_artist(client, catalog):
+  status, body, url = client.post('/artists/create', {
+    'name': 'Load Test Artist {}'.format(random.randint(0, 10 ** 9)),
+    'city': random.choice(['San Francisco', 'New York', 'Austin']),
+    'state': random.choice(['CA', 'NY', 'TX']),
+    'genres': random.sample(['Jazz', 'Blues', 'Folk', 'Soul', 'Funk'], 2),
+    'seeking_venue': 'y',
+  })
+  return status, status == 200 and not url.endswith('/artists/create')
+
+def op_edit_venue(client, catalog):
+  # Re-submits the current values of the venue, so the write is idempotent.
+  path = '/venues/{}/edit'.format(random.choice(catalog.venue_ids))
+  status, body, url = client.get(path)
+  if status != 200:
+    return status, False
+  data = defaultdict(list)
+  for name, value in parse_form(body):
+    data[name].append(value)
+  client.token = data.pop('csrf_token', [client.token])[0]
+  status, body, url = client.post(path, data)
+  return status, status == 200 and not url.endswith('/edit')
+
+OPERATIONS = {
+  'home': op_home,
+  'list_venues': op_list_venues,
+  'list_artists': op_list_artists,
+  'list_shows': op_list_shows,
+  'show_venue': op_show_venue,
+  'show_artist': op_show_artist,
+  'search_venues': op_search_venues,
+  'search_artists': op_search_artists,
+  'create_show': op_create_show,
+  'create_artist': op_create_artist,
+  'edit_venue': op_edit_venue,
+}
+
+class Catalog:
+  """Ids of the venues and artists the operations pick from."""
+
+  def __init__(self, client):
+    status, body, url = client.get('/venues')
+    self.venue_ids = sorted(set(int(i) for i in re.findall(r'href="/venues/(\d+)"', body)))
+    status, body, url = client.get('/artists')
+    self.artist_ids = sorted(set(int(i) for i in re.findall(r'href="/artists/(\d+)"', body)))
+    if not self.venue_ids or not self.artist_ids:
+      raise SystemExit('The target needs at least one venue and one artist to run a load test.')
+
+#----------------------------------------------------------------------------#
+# Statistics.
+#----------------------------------------------------------------------------#
+
+def percentile(values, fraction):
+  if not values:
+    return 0.0
+  values = sorted(values)
+  index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+  return values[index]
+
+class Stats:
+  """Latencies and error counts, both per operation and per reporting window."""
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.latencies = defaultdict(list)
+    self.errors = defaultdict(int)
+    self.statuses = defaultdict(int)
+    self.window = []
+    self.window_errors = 0
+
+  def record(self, name, status, ok, elapsed):
+    with self.lock:
+      self.latencies[name].append(elapsed)
+      self.statuses[status] += 1
+      self.window.append(elapsed)
+      if not ok:
+        self.errors[name] += 1
+        self.window_errors += 1
+
+  def take_window(self):
+    with self.lock:
+      window, errors = self.window, self.window_errors
+      self.window, self.window_errors = [], 0
+    return window, errors
+
+def fetch_pool_status(client):
+  """Returns the DB pool status exposed by the app, or None if unavailable."""
+  try:
+    status, body, url = client.get('/status')
+    if status == 200:
+      return json.loads(body).get('pool')
+  except (OSError, ValueError):
+    pass
+  return None
+
+def format_pool(pool):
+  if not pool:
+    return 'pool n/a'
+  return 'pool {checked_out}/{size} out, {overflow} overflow'.format(**pool)
+
+#----------------------------------------------------------------------------#
+# Runner.
+#----------------------------------------------------------------------------#
+
+def worker(args, catalog, weights, stats, stop):
+  client = Client(args.url, args.timeout)
+  names = list(weights)
+  relative = [weights[name] for name in names]
+  while not stop.is_set():
+    name = random.choices(names, weights=relative)[0]
+    started = time.perf_counter()
+    try:
+      status, ok = OPERATIONS[name](client, catalog)
+    except OSError:
+      status, ok = 0, False
+    stats.record(name, status, ok and status < 400, time.perf_counter() - started)
+    if args.think:
+      time.sleep(random.uniform(0, args.think))
+
+def parse_mix(value):
+  weights = {}
+  for item in value.split(','):
+    name, _, weight = item.partition('=')
+    name = name.strip()
+    if name not in OPERATIONS:
+      raise argparse.ArgumentTypeError('unknown operation: {}'.format(name))
+    weights[name] = float(weight or 1)
+  return weights
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Generate mixed read/write traffic against a running Fyyur instance.')
+  parser.add_argument('--url', default='http://127.0.0.1:5000')
+  parser.add_argument('--profile', choices=sorted(PROFILES), default='browse')
+  parser.add_argument('--mix', type=parse_mix, help='custom weights, eg. "show_venue=3,create_show=1"; overrides --profile')
+  parser.add_argument('--workers', type=int, default=8)
+  parser.add_argument('--duration', type=float, default=30, help='seconds')
+  parser.add_argument('--interval', type=float, default=5, help='seconds between progress lines')
+  parser.add_argument('--think', type=float, default=0, help='max random pause between requests of a worker, in seconds')
+  parser.add_argument('--timeout', type=float, default=30)
+  args = parser.parse_args(argv)
+
+  weights = args.mix or PROFILES[args.profile]
+  monitor = Client(args.url, args.timeout)
+  catalog = Catalog(monitor)
+  stats = Stats()
+  stop = threading.Event()
+
+  print('Load testing {} with {} workers for {}s, mix: {}'.format(
+    args.url, args.workers, args.duration,
+    ', '.join('{}={}'.format(name, weight) for name, weight in weights.items())
+  ))
+
+  threads = [
+    threading.Thread(target=worker, args=(args, catalog, weights, stats, stop), daemon=True)
+    for _ in range(args.workers)
+  ]
+  started = time.perf_counter()
+  for thread in threads:
+    thread.start()
+
+  pool_samples = []
+  deadline = started + args.duration
+  window_started = started
+  while time.perf_counter() < deadline:
+    time.sleep(min(args.interval, max(0, deadline - time.perf_counter())))
+    window, errors = stats.take_window()
+    now = time.perf_counter()
+    window_elapsed, window_started = max(now - window_started, 1e-9), now
+    pool = fetch_pool_status(monitor)
+    if pool:
+      pool_samples.append(pool)
+    print('[{:6.1f}s] {:7.1f} req/s  p50 {:6.1f}ms  p95 {:6.1f}ms  p99 {:6.1f}ms  errors {:5.1%}  {}'.format(
+      time.perf_counter() - started,
+      len(window) / window_elapsed,
+      percentile(window, 0.50) * 1000,
+      percentile(window, 0.95) * 1000,
+      percentile(window, 0.99) * 1000,
+      errors / len(window) if window else 0,
+      format_pool(pool),
+    ))
+
+  stop.set()
+  for thread in threads:
+    thread.join(args.timeout)
+  elapsed = time.perf_counter() - started
+
+  print()
+  print('{:<16} {:>8} {:>9} {:>9} {:>9} {:>9} {:>8}'.format('operation', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+  total = 0
+  total_errors = 0
+  for name in sorted(stats.latencies):
+    latencies = stats.latencies[name]
+    total += len(latencies)
+    total_errors += stats.errors[name]
+    print('{:<16} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.1%}'.format(
+      name, len(latencies), len(latencies) / elapsed,
+      percentile(latencies, 0.50) * 1000,
+      percentile(latencies, 0.95) * 1000,
+      percentile(latencies, 0.99) * 1000,
+      stats.errors[name] / len(latencies),
+    ))
+  print('{:<16} {:>8} {:>9.1f} {:>39} {:>8.1%}'.format(
+    'total', total, total / elapsed, '', total_errors / total if total else 0
+  ))
+  print('status codes: ' + ', '.join('{}={}'.format(code, count) for code, count in sorted(stats.statuses.items())))
+  if pool_samples:
+    print('pool: peak {} checked out, peak {} overflow'.format(
+      max(sample['checked_out'] for sample in pool_samples),
+      max(sample['overflow'] for sample in pool_samples),
+    ))
+  return 1 if total_errors else 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,161 @@
+import threading
+import time
+
+# Ids are stored as bits of Python ints: bit n is set when entity n is in
+# the set. Unions and intersections of 100k ids are then a few microseconds.
+
+def iter_bits(mask):
+  """Yields the ids in `mask`, lowest first."""
+  while mask:
+    low = mask & -mask
+    yield low.bit_length() - 1
+    mask ^= low
+
+class MatchIndex:
+  """Inverted index of one side of the matching: artists or venues.
+
+  Maps each genre, state and location to the bitset of the entities that
+  have it. Only entities that are seeking (seeking_venue for artists,
+  seeking_talent for venues) can be matched.
+  """
+
+  def __init__(self):
+    self.genres = {}
+    self.states = {}
+    self.locations = {}
+    self.seeking = 0
+    self.entries = {}
+
+  def add(self, id, genres, state, location_id, seeking):
+    self.remove(id)
+    bit = 1 << id
+    genres = tuple(set(genres or ()))
+    for genre in genres:
+      self.genres[genre] = self.genres.get(genre, 0) | bit
+    self.states[state] = self.states.get(state, 0) | bit
+    self.locations[location_id] = self.locations.get(location_id, 0) | bit
+    if seeking:
+      self.seeking |= bit
+    self.entries[id] = (genres, state, location_id)
+
+  def remove(self, id):
+    entry = self.entries.pop(id, None)
+    if entry is None:
+      return
+    genres, state, location_id = entry
+    bit = 1 << id
+    for genre in genres:
+      self.genres[genre] &= ~bit
+    self.states[state] &= ~bit
+    self.locations[location_id] &= ~bit
+    self.seeking &= ~bit
+
+  def top(self, genres, state, location_id, limit=10):
+    """Returns up to `limit` (id, shared genres count, locality) tuples.
+
+    Ranked by shared genres, then locality: 2 for the same location, 1 for
+    the same state, 0 otherwise, then by id.
+    """
+    genre_sets = [self.genres.get(genre, 0) & self.seeking for genre in set(genres or ())]
+
+    # at_least[n] holds the entities sharing at least n of the genres
+    at_least = [self.seeking] + [0] * len(genre_sets)
+    for genre_set in genre_sets:
+      for n in range(len(genre_sets), 0, -1):
+        at_least[n] |= at_least[n - 1] & genre_set
+    at_least.append(0)
+
+    same_location = self.locations.get(location_id, 0) if location_id is not None else 0
+    same_state = self.states.get(state, 0) & ~same_location
+
+    results = []
+    for n in range(len(genre_sets), 0, -1):
+      exactly = at_least[n] & ~at_least[n + 1]
+      tiers = (
+        (2, exactly & same_location),
+        (1, exactly & same_state),
+        (0, exactly & ~same_location & ~same_state),
+      )
+      for locality, mask in tiers:
+        for id in iter_bits(mask):
+          results.append((id, n, locality))
+          if len(results) == limit:
+            return results
+    return results
+
+class MatchEngine:
+  """Artist and venue indexes, built from the database on first use and then
+  kept up to date by the views that write artists and venues.
+
+  Each process keeps its own indexes. Before each lookup the rows created
+  since the last read are added, with a query on the primary key, so new
+  artists and venues from other processes show up right away. Edits and
+  deletes made by other processes are picked up by a full rebuild once
+  the indexes are older than `ttl` seconds; reset() forces one.
+  """
+
+  def __init__(self, db, Artist, Venue, ttl=300):
+    self.db = db
+    self.Artist = Artist
+    self.Venue = Venue
+    self.ttl = ttl
+    self.artists = None
+    self.venues = None
+    self._expires = 0
+    self._last_ids = (0, 0)
+    self._lock = threading.Lock()
+
+  def _load(self, index, model, seeking, after):
+    """Adds the rows with an id above `after`, returns the highest id read."""
+    last_id = after
+    for row in self.db.session.query(model.id, model.genres, model.state, model.location_id, seeking) \
+      .filter(model.id > after) \
+      .order_by(model.id) \
+      .yield_per(1000):
+      index.add(*row)
+      last_id = row[0]
+    return last_id
+
+  def _refresh(self):
+    # Called with the lock held
+    if self.artists is None or time.monotonic() >= self._expires:
+      self.artists, self.venues = MatchIndex(), MatchIndex()
+      self._last_ids = (0, 0)
+      self._expires = time.monotonic() + self.ttl
+    # Ids are read from the database only, rows added by update_*() are
+    # read again here, which add() allows
+    last_artist, last_venue = self._last_ids
+    self._last_ids = (
+      self._load(self.artists, self.Artist, self.Artist.seeking_venue, last_artist),
+      self._load(self.venues, self.Venue, self.Venue.seeking_talent, last_venue),
+    )
+
+  def reset(self):
+    with self._lock:
+      self.artists = None
+      self.venues = None
+
+  def update_artist(self, artist):
+    with self._lock:
+      if self.artists is not None:
+        self.artists.add(artist.id, artist.genres, artist.state, artist.location_id, artist.seeking_venue)
+
+  def update_venue(self, venue):
+    with self._lock:
+      if self.venues is not None:
+        self.venues.add(venue.id, venue.genres, venue.state, venue.location_id, venue.seeking_talent)
+
+  def remove_venue(self, venue_id):
+    with self._lock:
+      if self.venues is not None:
+        self.venues.remove(venue_id)
+
+  def artists_for_venue(self, venue, limit=10):
+    with self._lock:
+      self._refresh()
+      return self.artists.top(venue.genres, venue.state, venue.location_id, limit)
+
+  def venues_for_artist(self, artist, limit=10):
+    with self._lock:
+      self._refresh()
+      return self.venues.top(artist.genres, artist.state, artist.location_id, limit)
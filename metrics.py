@@ -0,0 +1,333 @@
+import threading
+import time
+from bisect import bisect_left
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Prometheus text exposition format, see
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+#----------------------------------------------------------------------------#
+# Metric types.
+#----------------------------------------------------------------------------#
+
+# Each thread updates its own shard of values, one dict per metric, and the
+# shards are only summed when /metrics is scraped. A thread takes the lock
+# once, the first time it records anything, to register its shard; that is
+# also when the shards of finished threads are folded into each metric's
+# `_merged` values, so the number of shards follows the number of live
+# threads whether or not anything scrapes /metrics.
+
+class _Shards:
+  def __init__(self):
+    self._local = threading.local()
+    self._threads = []
+    self.lock = threading.Lock()
+
+  def get(self):
+    """The {metric: values} shard of the current thread."""
+    try:
+      return self._local.shard
+    except AttributeError:
+      shard = {}
+      with self.lock:
+        self.fold()
+        self._threads.append((threading.current_thread(), shard))
+      self._local.shard = shard
+      return shard
+
+  def fold(self):
+    """Merges away the shards of finished threads and returns the live
+    ones. Called with the lock held."""
+    alive = []
+    for thread, shard in self._threads:
+      if thread.is_alive():
+        alive.append((thread, shard))
+      else:
+        for metric, values in shard.items():
+          metric._merge(values)
+    self._threads = alive
+    return [shard for thread, shard in alive]
+
+_shards = _Shards()
+
+def _escape(value):
+  return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=''):
+  pairs = ['{}="{}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+  if extra:
+    pairs.append(extra)
+  return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+  if value == float('inf'):
+    return '+Inf'
+  if float(value).is_integer():
+    return str(int(value))
+  return repr(float(value))
+
+class Metric:
+  kind = None
+
+  def __init__(self, name, documentation, labelnames=()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self._merged = {}
+    self._function = None
+
+  def _values(self):
+    shard = _shards.get()
+    values = shard.get(self)
+    if values is None:
+      # Only this thread writes to its shard, no lock needed
+      values = shard[self] = {}
+    return values
+
+  def _merge(self, values):
+    for key, value in values.items():
+      self._merged[key] = self._add(self._merged.get(key, self._empty()), value)
+
+  def _empty(self):
+    return 0
+
+  def _add(self, total, value):
+    return total + value
+
+  def set_function(self, function):
+    """Computes the samples on scrape instead: `function` returns a dict of
+    label values tuple to value."""
+    self._function = function
+
+  def collect(self):
+    if self._function is not None:
+      return dict(self._function())
+    with _shards.lock:
+      shards = [dict(shard[self]) for shard in _shards.fold() if self in shard]
+      total = dict(self._merged)
+    for values in shards:
+      for key, value in values.items():
+        total[key] = self._add(total.get(key, self._empty()), value)
+    return total
+
+  def render(self):
+    lines = [
+      '# HELP {} {}'.format(self.name, self.documentation),
+      '# TYPE {} {}'.format(self.name, self.kind),
+    ]
+    for key, value in sorted(self.collect().items()):
+      lines.append('{}{} {}'.format(self.name, _format_labels(self.labelnames, key), _format_value(value)))
+    return lines
+
+class Counter(Metric):
+  kind = 'counter'
+
+  def inc(self, labels=(), amount=1):
+    values = self._values()
+    values[labels] = values.get(labels, 0) + amount
+
+class Gauge(Metric):
+  kind = 'gauge'
+
+  def inc(self, labels=(), amount=1):
+    values = self._values()
+    values[labels] = values.get(labels, 0) + amount
+
+  def dec(self, labels=(), amount=1):
+    self.inc(labels, -amount)
+
+class Histogram(Metric):
+  kind = 'histogram'
+
+  def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    super().__init__(name, documentation, labelnames)
+    self.buckets = tuple(buckets) + (float('inf'),)
+
+  def _empty(self):
+    # One count per bucket, then the sum of the observations.
+    return [0] * len(self.buckets) + [0]
+
+  def _add(self, total, value):
+    return [a + b for a, b in zip(total, value)]
+
+  def observe(self, value, labels=()):
+    values = self._values()
+    counts = values.get(labels)
+    if counts is None:
+      counts = values[labels] = self._empty()
+    counts[bisect_left(self.buckets, value)] += 1
+    counts[-1] += value
+
+  def render(self):
+    lines = [
+      '# HELP {} {}'.format(self.name, self.documentation),
+      '# TYPE {} {}'.format(self.name, self.kind),
+    ]
+    for key, counts in sorted(self.collect().items()):
+      cumulative = 0
+      for bound, count in zip(self.buckets, counts):
+        cumulative += count
+        le = 'le="{}"'.format(_format_value(bound))
+        lines.append('{}_bucket{} {}'.format(self.name, _format_labels(self.labelnames, key, le), cumulative))
+      labels = _format_labels(self.labelnames, key)
+      lines.append('{}_sum{} {}'.format(self.name, labels, _format_value(counts[-1])))
+      lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+    return lines
+
+class Registry:
+  def __init__(self):
+    self.metrics = []
+
+  def register(self, metric):
+    self.metrics.append(metric)
+    return metric
+
+  def render(self):
+    lines = []
+    for metric in self.metrics:
+      lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+#----------------------------------------------------------------------------#
+# Fyyur metrics.
+#----------------------------------------------------------------------------#
+
+request_latency = registry.register(Histogram(
+  'fyyur_request_duration_seconds', 'Time spent handling a request, by endpoint.', ['endpoint', 'method']
+))
+request_status = registry.register(Counter(
+  'fyyur_requests_total', 'Responses sent, by endpoint and status code.', ['endpoint', 'method', 'status']
+))
+requests_in_flight = registry.register(Gauge(
+  'fyyur_requests_in_flight', 'Requests currently being handled.'
+))
+request_queries = registry.register(Histogram(
+  'fyyur_db_queries_per_request', 'SQL statements executed per request, by endpoint.', ['endpoint'], QUERY_BUCKETS
+))
+queries_total = registry.register(Counter(
+  'fyyur_db_queries_total', 'SQL statements executed.'
+))
+template_render = registry.register(Histogram(
+  'fyyur_template_render_seconds', 'Time spent rendering a template, by template name.', ['template']
+))
+pool_size = registry.register(Gauge(
+  'fyyur_db_pool_size', 'Connections the SQLAlchemy pool keeps open.'
+))
+pool_checked_out = registry.register(Gauge(
+  'fyyur_db_pool_checked_out', 'SQLAlchemy pool connections currently in use.'
+))
+pool_overflow = registry.register(Gauge(
+  'fyyur_db_pool_overflow', 'SQLAlchemy pool connections opened beyond the pool size.'
+))
+
+group_commit_batch = registry.register(Histogram(
+  'fyyur_group_commit_batch_size', 'Inserts committed together by the group commit writer.', [], (1, 2, 4, 8, 16, 32, 64, 128)
+))
+
+cache_lookups = registry.register(Counter(
+  'fyyur_cache_lookups_total', 'Cache lookups, by cache and result.', ['cache', 'result']
+))
+cache_entries = registry.register(Gauge(
+  'fyyur_cache_entries', 'Entries currently held, by cache.', ['cache']
+))
+
+cache_bytes = registry.register(Gauge(
+  'fyyur_cache_bytes', 'Approximate memory held by the entries, by cache.', ['cache']
+))
+
+# Cache name to a function returning its stats() dict
+_caches = {}
+
+def register_cache(name, stats):
+  """Exposes the hits, prefix_hits, misses, entries and bytes reported by
+  `stats`."""
+  _caches[name] = stats
+
+def _collect_cache_lookups():
+  samples = {}
+  for name, stats in _caches.items():
+    values = stats()
+    for result in ('hits', 'prefix_hits', 'misses'):
+      if result in values:
+        samples[(name, result)] = values[result]
+  return samples
+
+cache_lookups.set_function(_collect_cache_lookups)
+cache_entries.set_function(lambda: {(name,): stats()['entries'] for name, stats in _caches.items()})
+
+def _collect_cache_bytes():
+  samples = {}
+  for name, stats in _caches.items():
+    values = stats()
+    if 'bytes' in values:
+      samples[(name,)] = values['bytes']
+  return samples
+
+cache_bytes.set_function(_collect_cache_bytes)
+
+def _endpoint():
+  return request.endpoint or 'none'
+
+def _before_request():
+  g.metrics_started = time.perf_counter()
+  g.metrics_queries = 0
+  requests_in_flight.inc()
+
+def _after_request(response):
+  g.metrics_status = response.status_code
+  return response
+
+# after_request runs before a streamed body is generated, so the request is
+# only observed at teardown, which for streamed responses runs once the last
+# chunk is produced
+def _teardown_request(error):
+  started = g.pop('metrics_started', None)
+  if started is None:
+    return
+  endpoint = _endpoint()
+  request_latency.observe(time.perf_counter() - started, (endpoint, request.method))
+  request_status.inc((endpoint, request.method, str(g.pop('metrics_status', 500))))
+  request_queries.observe(g.get('metrics_queries', 0), (endpoint,))
+  requests_in_flight.dec()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  queries_total.inc()
+  if has_request_context() and 'metrics_queries' in g:
+    g.metrics_queries += 1
+
+def _before_render_template(sender, template, context, **extra):
+  if has_request_context():
+    g.setdefault('metrics_templates', []).append(time.perf_counter())
+
+def _template_rendered(sender, template, context, **extra):
+  if has_request_context() and g.get('metrics_templates'):
+    started = g.metrics_templates.pop()
+    template_render.observe(time.perf_counter() - started, (template.name or 'string',))
+
+def init_app(app, db):
+  """Hooks the request, SQL and template instrumentation into `app`."""
+  app.before_request(_before_request)
+  app.after_request(_after_request)
+  app.teardown_request(_teardown_request)
+  event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+  before_render_template.connect(_before_render_template, app)
+  template_rendered.connect(_template_rendered, app)
+
+  def pool_gauge(read):
+    def collect():
+      with app.app_context():
+        return {(): read(db.engine.pool)}
+    return collect
+
+  pool_size.set_function(pool_gauge(lambda pool: pool.size()))
+  pool_checked_out.set_function(pool_gauge(lambda pool: pool.checkedout()))
+  pool_overflow.set_function(pool_gauge(lambda pool: max(pool.overflow(), 0)))
@@ -1,7 +1,40 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import insert
+from enums import State
 
 db = SQLAlchemy()
 
+class Location(db.Model):
+  __tablename__ = 'Location'
+  __table_args__ = (db.UniqueConstraint('city_key', 'state'),)
+
+  id = db.Column(db.Integer, primary_key=True)
+  city = db.Column(db.String(120), nullable=False)
+  # Lower cased city with collapsed whitespace, so that "San Francisco" and
+  # "san francisco " are the same location
+  city_key = db.Column(db.String(120), nullable=False)
+  state = db.Column(db.Enum(State), nullable=False)
+  venues = db.relationship('Venue', back_populates='location', lazy=True)
+  artists = db.relationship('Artist', back_populates='location', lazy=True)
+
+  @classmethod
+  def get_or_create(cls, city, state):
+    city = ' '.join(city.split())
+    city_key = city.lower()
+    state = State[state]
+    location = cls.query.filter_by(city_key=city_key, state=state).one_or_none()
+    if location is not None:
+      return location
+    # Only new cities are inserted, each INSERT takes an id from the sequence
+    # even when it conflicts. ON CONFLICT keeps concurrent submissions for
+    # the same new city from failing on the unique constraint.
+    db.session.execute(
+      insert(cls)
+        .values(city=city, city_key=city_key, state=state)
+        .on_conflict_do_nothing(index_elements=['city_key', 'state'])
+    )
+    return cls.query.filter_by(city_key=city_key, state=state).one()
+
 class Venue(db.Model):
   __tablename__ = 'Venue'
 
@@ -17,6 +50,8 @@ class Venue(db.Model):
   website_link = db.Column(db.String(120))
   seeking_talent = db.Column(db.Boolean, nullable=False)
   seeking_description = db.Column(db.String(500))
+  location_id = db.Column(db.Integer, db.ForeignKey('Location.id'), index=True)
+  location = db.relationship('Location', back_populates='venues', lazy=True)
   shows = db.relationship('Show', back_populates='venue', lazy='joined', cascade='all, delete')
 
 class Artist(db.Model):
@@ -33,10 +68,18 @@ class Artist(db.Model):
   website_link = db.Column(db.String(120))
   seeking_venue = db.Column(db.Boolean, nullable=False)
   seeking_description = db.Column(db.String(500))
+  location_id = db.Column(db.Integer, db.ForeignKey('Location.id'), index=True)
+  location = db.relationship('Location', back_populates='artists', lazy=True)
   shows = db.relationship('Show', back_populates='artist', lazy='joined', cascade='all, delete')
 
 class Show(db.Model):
   __tablename__ = 'Show'
+  # A venue or an artist has at most one show at a time. The constraints'
+  # indexes also serve the lookups by venue_id and artist_id.
+  __table_args__ = (
+    db.UniqueConstraint('venue_id', 'start_time'),
+    db.UniqueConstraint('artist_id', 'start_time'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
@@ -44,3 +87,21 @@ class Show(db.Model):
   start_time = db.Column(db.DateTime, nullable=False)
   artist = db.relationship('Artist', back_populates='shows', lazy=True)
   venue = db.relationship('Venue', back_populates='shows', lazy='joined', cascade='all, delete')
+
+class ShowRollup(db.Model):
+  __tablename__ = 'ShowRollup'
+  __table_args__ = (db.Index('ix_ShowRollup_dimension_month', 'dimension', 'month'),)
+
+  # Shows per month along one dimension: 'venue' and 'artist' (keyed by id),
+  # 'genre' (the artist's genres) or 'state' (the venue's state)
+  dimension = db.Column(db.String(16), primary_key=True)
+  key = db.Column(db.String(120), primary_key=True)
+  month = db.Column(db.Date, primary_key=True)
+  show_count = db.Column(db.Integer, nullable=False)
+
+class RollupWatermark(db.Model):
+  __tablename__ = 'RollupWatermark'
+
+  name = db.Column(db.String(32), primary_key=True)
+  # Shows up to this id are counted in the rollups
+  last_show_id = db.Column(db.Integer, nullable=False)
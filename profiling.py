@@ -0,0 +1,216 @@
+import cProfile
+import hmac
+import io
+import itertools
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from urllib.parse import urlencode
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+HEADER = 'X-Profile'
+PARAM = '_profile'
+
+class Profiler:
+  """Profiles single requests on demand and keeps the last reports.
+
+  A request is profiled when it carries the PROFILE_TOKEN in the X-Profile
+  header or the _profile query parameter, or when it is picked by the
+  PROFILE_SAMPLE_RATE sampling. The report holds the cProfile output of the
+  request, every SQL statement it ran with EXPLAIN (ANALYZE, BUFFERS) for
+  the SELECTs slower than PROFILE_SLOW_QUERY_MS, and template render times.
+
+  Only one request is profiled at a time: from Python 3.12 cProfile hooks
+  into sys.monitoring, which is process wide, and a second profiler can not
+  be enabled while one is running. Requests arriving meanwhile are served
+  without a report.
+
+  When neither a token nor a sample rate is configured no hook is installed
+  at all, so profiling costs nothing when it is switched off.
+  """
+
+  def __init__(self, app=None, db=None):
+    self.reports = deque()
+    self._ids = itertools.count(1)
+    self._lock = threading.Lock()
+    self._active = threading.Lock()
+    if app is not None:
+      self.init_app(app, db)
+
+  def init_app(self, app, db):
+    self.db = db
+    self.token = app.config.get('PROFILE_TOKEN')
+    self.sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+    self.slow_query = app.config.get('PROFILE_SLOW_QUERY_MS', 50) / 1000
+    self.reports = deque(maxlen=app.config.get('PROFILE_REPORTS', 50))
+    self.enabled = bool(self.token) or self.sample_rate > 0
+    if not self.enabled:
+      return
+
+    app.before_request(self._before_request)
+    app.after_request(self._after_request)
+    app.teardown_request(self._teardown_request)
+    event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+    before_render_template.connect(self._before_render_template, app)
+    template_rendered.connect(self._template_rendered, app)
+
+  def is_admin(self):
+    """True when the request carries the profiling token."""
+    if not self.token:
+      return False
+    return self._matches(request.headers.get(HEADER)) or self._matches(request.args.get(PARAM))
+
+  def link_token(self):
+    """The token for links to other reports: only when the request carried
+    it in the query string, a client sending the header keeps doing so."""
+    if not self.is_admin() or self._matches(request.headers.get(HEADER)):
+      return None
+    return request.args.get(PARAM)
+
+  def _matches(self, value):
+    # Constant time, so response times do not leak how much of a guess is right
+    return value is not None and hmac.compare_digest(value.encode(), self.token.encode())
+
+  def get(self, report_id):
+    with self._lock:
+      for report in self.reports:
+        if report['id'] == report_id:
+          return report
+    return None
+
+  def list(self):
+    with self._lock:
+      return list(reversed(self.reports))
+
+  #  Request hooks
+  #  ----------------------------------------------------------------
+
+  def _before_request(self):
+    # Viewing the reports is not worth a report of its own
+    if (request.endpoint or '').startswith('profile'):
+      return
+    if not self.is_admin() and random.random() >= self.sample_rate:
+      return
+    if not self._active.acquire(blocking=False):
+      # Another request is being profiled
+      return
+    g.profile = {
+      "profiler": cProfile.Profile(),
+      "queries": [],
+      "templates": [],
+      "explaining": False,
+      "started": time.perf_counter(),
+    }
+    g.profile['profiler'].enable()
+
+  def _after_request(self, response):
+    profile = g.get('profile')
+    if profile is None:
+      return response
+    # The report is only written at teardown, after a streamed body has been
+    # generated, but its id goes out with the headers
+    profile['id'] = next(self._ids)
+    profile['status'] = response.status_code
+    response.headers['X-Profile-Id'] = str(profile['id'])
+    return response
+
+  def _teardown_request(self, error):
+    profile = g.get('profile')
+    if profile is None:
+      return
+    try:
+      profile['profiler'].disable()
+      # Requests that failed before after_request ran get no report
+      if 'id' in profile:
+        self._report(profile, time.perf_counter() - profile['started'])
+    finally:
+      g.pop('profile', None)
+      self._active.release()
+
+  def _report(self, profile, duration):
+    output = io.StringIO()
+    stats = pstats.Stats(profile['profiler'], stream=output)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(40)
+    if request.endpoint:
+      stats.print_callees(r'\b{}\b'.format(request.endpoint))
+
+    profile['explaining'] = True
+    for query in profile['queries']:
+      if query['duration'] >= self.slow_query and query['statement'].lstrip().upper().startswith('SELECT'):
+        query['plan'] = self._explain(query['statement'], query['parameters'])
+
+    report = {
+      "id": profile['id'],
+      "time": datetime.now(),
+      "method": request.method,
+      "path": self._path(),
+      "endpoint": request.endpoint,
+      "status": profile['status'],
+      "duration": duration,
+      "sql_duration": sum(query['duration'] for query in profile['queries']),
+      "render_duration": sum(duration for name, duration in profile['templates']),
+      "profile": output.getvalue(),
+      "queries": profile['queries'],
+      "templates": profile['templates'],
+    }
+    with self._lock:
+      self.reports.append(report)
+    return report
+
+  def _path(self):
+    # Drops the token, it would otherwise be stored and shown with the report
+    args = [(name, value) for name, value in request.args.items(multi=True) if name != PARAM]
+    return request.path + ('?' + urlencode(args) if args else '')
+
+  def _explain(self, statement, parameters):
+    # EXPLAIN ANALYZE runs the statement again, on its own connection so it
+    # is rolled back and never mixes with the request's transaction
+    try:
+      with self.db.engine.connect() as connection:
+        rows = connection.exec_driver_sql('EXPLAIN (ANALYZE, BUFFERS) ' + statement, parameters).all()
+        connection.rollback()
+      return '\n'.join(row[0] for row in rows)
+    except Exception as e:
+      return 'EXPLAIN failed: {}'.format(e)
+
+  #  SQL and template hooks
+  #  ----------------------------------------------------------------
+
+  def _current(self):
+    if not has_request_context():
+      return None
+    profile = g.get('profile')
+    if profile is None or profile['explaining']:
+      return None
+    return profile
+
+  def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    if self._current() is not None:
+      conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+  def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+    profile = self._current()
+    if profile is None or not conn.info.get('profile_started'):
+      return
+    profile['queries'].append({
+      "statement": statement,
+      "parameters": None if executemany else parameters,
+      "duration": time.perf_counter() - conn.info['profile_started'].pop(),
+      "plan": None,
+    })
+
+  def _before_render_template(self, sender, template, context, **extra):
+    profile = self._current()
+    if profile is not None:
+      profile.setdefault('rendering', []).append(time.perf_counter())
+
+  def _template_rendered(self, sender, template, context, **extra):
+    profile = self._current()
+    if profile is not None and profile.get('rendering'):
+      profile['templates'].append((template.name, time.perf_counter() - profile['rendering'].pop()))
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Characters LIKE treats as wildcards. A term containing one cannot be
+# answered by filtering a shorter term's results with a substring match.
+LIKE_WILDCARDS = ('%', '_', '\\')
+
+def normalize_term(term):
+  """Lower cased with collapsed whitespace, used both as the cache key and as
+  the term that is actually searched for."""
+  return ' '.join(term.split()).lower()
+
+class SearchCache:
+  """LRU cache of search results keyed by (entity, normalized term).
+
+  Results are lists of dicts with at least a "name" key, as built by
+  search_venues() and search_artists(). Searches are substring matches, so
+  the results for "jazz c" are a subset of the results for "jazz": a miss on
+  a term is answered from the longest cached prefix of it when that result
+  set is small enough to filter.
+
+  The cache is per process. invalidate() only clears this process, the TTL
+  bounds how stale the other processes can get.
+  """
+
+  def __init__(self, max_entries=1024, ttl=60, prefix_max_rows=200):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self.prefix_max_rows = prefix_max_rows
+    self._entries = OrderedDict()
+    self._generations = {}
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.prefix_hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def generation(self, entity):
+    """Pass the value to put(), so results read before an invalidation are
+    not cached after it."""
+    return self._generations.get(entity, 0)
+
+  def get(self, entity, term):
+    now = time.monotonic()
+    with self._lock:
+      entry = self._entries.get((entity, term))
+      if entry is not None and entry[0] > now:
+        self._entries.move_to_end((entity, term))
+        self.hits += 1
+        return entry[1]
+
+      if not any(char in term for char in LIKE_WILDCARDS):
+        for length in range(len(term) - 1, 0, -1):
+          entry = self._entries.get((entity, term[:length]))
+          if entry is None or entry[0] <= now or len(entry[1]) > self.prefix_max_rows:
+            continue
+          rows = [row for row in entry[1] if term in row['name'].lower()]
+          # Keeps the expiry of the prefix, the rows are no fresher than it
+          self._store((entity, term), (entry[0], rows))
+          self.prefix_hits += 1
+          return rows
+
+      self.misses += 1
+      return None
+
+  def put(self, entity, term, rows, generation):
+    with self._lock:
+      if generation != self.generation(entity):
+        return
+      self._store((entity, term), (time.monotonic() + self.ttl, rows))
+
+  def _store(self, key, entry):
+    self._entries[key] = entry
+    self._entries.move_to_end(key)
+    while len(self._entries) > self.max_entries:
+      self._entries.popitem(last=False)
+      self.evictions += 1
+
+  def invalidate(self, *entities):
+    with self._lock:
+      for entity in entities:
+        self._generations[entity] = self.generation(entity) + 1
+      for key in [key for key in self._entries if key[0] in entities]:
+        del self._entries[key]
+
+  def stats(self):
+    with self._lock:
+      lookups = self.hits + self.prefix_hits + self.misses
+      return {
+        "entries": len(self._entries),
+        "hits": self.hits,
+        "prefix_hits": self.prefix_hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "hit_rate": (self.hits + self.prefix_hits) / lookups if lookups else 0.0,
+      }
@@ -0,0 +1,143 @@
+import zlib
+
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+COMPRESSIBLE_TYPES = (
+  'text/',
+  'application/json',
+  'application/javascript',
+  'image/svg+xml',
+)
+
+def buffered(chunks, size=8192):
+  """Joins the small strings a streamed template yields into chunks of about
+  `size` characters, so each write to the client carries a useful amount."""
+  buffer = []
+  length = 0
+  for chunk in chunks:
+    buffer.append(chunk)
+    length += len(chunk)
+    if length >= size:
+      yield ''.join(buffer)
+      buffer = []
+      length = 0
+  if buffer:
+    yield ''.join(buffer)
+
+def accepted_encodings(header):
+  encodings = set()
+  for item in header.split(','):
+    name, _, params = item.strip().partition(';')
+    quality = 1.0
+    params = params.strip()
+    if params.startswith('q='):
+      try:
+        quality = float(params[2:])
+      except ValueError:
+        pass
+    if name and quality > 0:
+      encodings.add(name.strip().lower())
+  return encodings
+
+class GzipStream:
+  def __init__(self, level):
+    self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+  def compress(self, data):
+    # The sync flush sends what was compressed so far, the client can start
+    # parsing before the response is complete
+    return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+  def finish(self):
+    return self.compressor.flush()
+
+class BrotliStream:
+  def __init__(self, level):
+    self.compressor = brotli.Compressor(quality=level)
+
+  def compress(self, data):
+    return self.compressor.process(data) + self.compressor.flush()
+
+  def finish(self):
+    return self.compressor.finish()
+
+class CompressionMiddleware:
+  """WSGI middleware compressing responses chunk by chunk as they are sent.
+
+  Responses are never buffered whole, so streamed pages keep their time to
+  first byte. Uses brotli when the client accepts it and the brotli package
+  is installed, gzip otherwise.
+  """
+
+  def __init__(self, app, gzip_level=6, brotli_level=4):
+    self.app = app
+    self.gzip_level = gzip_level
+    self.brotli_level = brotli_level
+
+  def __call__(self, environ, start_response):
+    encodings = accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING', ''))
+    if brotli is not None and 'br' in encodings:
+      encoding = 'br'
+    elif 'gzip' in encodings:
+      encoding = 'gzip'
+    else:
+      return self.app(environ, start_response)
+
+    compress = []
+
+    def compressing_start_response(status, headers, exc_info=None):
+      if self._should_compress(environ, status, headers):
+        headers = self._compressed_headers(headers, encoding)
+        compress.append(True)
+      return start_response(status, headers, exc_info)
+
+    app_iter = self.app(environ, compressing_start_response)
+    if not compress:
+      return app_iter
+    return self._compress(app_iter, encoding)
+
+  def _should_compress(self, environ, status, headers):
+    if environ.get('REQUEST_METHOD') == 'HEAD' or status[:3] in ('204', '206', '304'):
+      return False
+    headers = dict((name.lower(), value) for name, value in headers)
+    if 'content-encoding' in headers or 'content-range' in headers:
+      return False
+    return headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES)
+
+  def _compressed_headers(self, headers, encoding):
+    compressed = []
+    vary = ['Accept-Encoding']
+    for name, value in headers:
+      lower = name.lower()
+      if lower in ('content-length', 'accept-ranges'):
+        # Neither holds for the compressed body
+        continue
+      if lower == 'vary':
+        vary.insert(0, value)
+        continue
+      if lower == 'etag' and not value.startswith('W/'):
+        # The compressed body is not byte for byte the tagged one
+        value = 'W/' + value
+      compressed.append((name, value))
+    compressed.append(('Content-Encoding', encoding))
+    compressed.append(('Vary', ', '.join(vary)))
+    return compressed
+
+  def _compress(self, app_iter, encoding):
+    if encoding == 'br':
+      stream = BrotliStream(self.brotli_level)
+    else:
+      stream = GzipStream(self.gzip_level)
+    try:
+      for chunk in app_iter:
+        if chunk:
+          data = stream.compress(chunk)
+          if data:
+            yield data
+      yield stream.finish()
+    finally:
+      if hasattr(app_iter, 'close'):
+        app_iter.close()
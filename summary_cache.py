@@ -0,0 +1,92 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+class Summary(NamedTuple):
+  """The fields of a venue or artist shown next to each of its shows."""
+  id: int
+  name: str
+  image_link: Optional[str]
+
+def _footprint(summary):
+  return sys.getsizeof(summary) + sum(sys.getsizeof(value) for value in summary)
+
+class SummaryCache:
+  """Bounded LRU cache of Summary tuples of one model, keyed by id.
+
+  get_many() answers from the cache and loads every miss with a single
+  IN query. invalidate() bumps a version: summaries read from the database
+  before an invalidation are not cached after it, so a concurrent edit can
+  not be overwritten by stale data.
+  """
+
+  def __init__(self, db, model, max_entries=10000, ttl=300):
+    self.db = db
+    self.model = model
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self._entries = OrderedDict()
+    self._version = 0
+    self._lock = threading.Lock()
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+
+  def get_many(self, ids):
+    """Returns {id: Summary} for the ids that exist."""
+    found = {}
+    missing = []
+    now = time.monotonic()
+    with self._lock:
+      version = self._version
+      for id in set(ids):
+        entry = self._entries.get(id)
+        if entry is not None and entry[0] > now:
+          self._entries.move_to_end(id)
+          found[id] = entry[1]
+        else:
+          missing.append(id)
+      self.hits += len(found)
+      self.misses += len(missing)
+
+    if missing:
+      rows = self.db.session.query(self.model.id, self.model.name, self.model.image_link) \
+        .filter(self.model.id.in_(missing)) \
+        .all()
+      loaded = [Summary(*row) for row in rows]
+      found.update((summary.id, summary) for summary in loaded)
+      with self._lock:
+        if version == self._version:
+          for summary in loaded:
+            self._store(summary, now + self.ttl)
+    return found
+
+  def _store(self, summary, expires):
+    old = self._entries.pop(summary.id, None)
+    if old is not None:
+      self.bytes -= _footprint(old[1])
+    self._entries[summary.id] = (expires, summary)
+    self.bytes += _footprint(summary)
+    while len(self._entries) > self.max_entries:
+      id, (expires, evicted) = self._entries.popitem(last=False)
+      self.bytes -= _footprint(evicted)
+
+  def invalidate(self, id):
+    with self._lock:
+      self._version += 1
+      entry = self._entries.pop(id, None)
+      if entry is not None:
+        self.bytes -= _footprint(entry[1])
+
+  def stats(self):
+    with self._lock:
+      lookups = self.hits + self.misses
+      return {
+        "entries": len(self._entries),
+        "bytes": self.bytes,
+        "hits": self.hits,
+        "misses": self.misses,
+        "hit_rate": self.hits / lookups if lookups else 0.0,
+      }